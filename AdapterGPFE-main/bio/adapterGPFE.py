@@ -5,7 +5,7 @@ from torch_geometric.nn import global_add_pool, global_mean_pool, global_max_poo
 import torch.nn.functional as F
 from loader import BioDataset
 from dataloader import DataLoaderFinetune
-from torch_scatter import scatter_add
+from torch_scatter import scatter_add, segment_coo
 from torch_geometric.nn.inits import glorot, zeros
 
 
@@ -24,8 +24,6 @@ class GINConv(MessagePassing):
     def __init__(self, emb_dim, aggr="add", input_layer=False):
         super(GINConv, self).__init__(aggr)
 
-        self.edge_encoder = torch.nn.Linear(9, emb_dim)
-
         # Multi-layer perceptron (MLP) for node aggregation
         self.mlp = torch.nn.Sequential(
             torch.nn.Linear(2 * emb_dim, 2 * emb_dim),
@@ -44,16 +42,9 @@ class GINConv(MessagePassing):
         self.embeded_x = None
         self.aggr_x = None
 
-    def forward(self, x, edge_index, edge_attr, prompt=None):
-        edge_index = add_self_loops(edge_index, num_nodes=x.size(1))
-
-        # Add features for self-loop edges
-        self_loop_attr = torch.zeros(x.size(0), 9, device=edge_attr.device, dtype=edge_attr.dtype)
-        self_loop_attr[:, 7] = 1
-        edge_attr = torch.cat((edge_attr, self_loop_attr), dim=0)
-
-        # Compute edge embeddings
-        edge_embeddings = self.edge_encoder(edge_attr)
+    def forward(self, x, edge_index, edge_embeddings, prompt=None):
+        # edge_index already carries the self-loops (appended once in the collate)
+        # and edge_embeddings the matching shared projection from the GNN
 
         # Apply input layer transformation if enabled
         if self.input_layer:
@@ -61,14 +52,17 @@ class GINConv(MessagePassing):
             if prompt is not None:
                 x = prompt.add(x)
 
-        return self.propagate(edge_index[0], x=x, edge_attr=edge_embeddings), x, self.aggr_x
-
-    def message(self, x_j, edge_attr):
-        return torch.cat([x_j, edge_attr], dim=1)
-
-    def update(self, aggr_out):
+        # aggregate the two halves of the concatenated message separately: the
+        # x_j half is a sparse matmul over the adjacency and the edge half a
+        # segment reduction, so the [E, 2*emb_dim] per-edge cat is never built
+        dst, src = edge_index[1], edge_index[0]
+        ones = torch.ones(dst.size(0), dtype=x.dtype, device=x.device)
+        adj = torch.sparse_coo_tensor(torch.stack((dst, src)), ones, (x.size(0), x.size(0)))
+        aggr_out = torch.cat((torch.sparse.mm(adj, x),
+                              segment_coo(edge_embeddings, dst, dim_size=x.size(0), reduce='sum')), dim=1)
         self.aggr_x = aggr_out
-        return self.mlp(aggr_out)
+
+        return self.mlp(aggr_out), x, self.aggr_x
 
 
 class GCNConv(MessagePassing):
@@ -79,9 +73,6 @@ class GCNConv(MessagePassing):
         self.emb_dim = emb_dim
         self.linear = torch.nn.Linear(emb_dim, emb_dim)
 
-        ### Mapping 0/1 edge features to embedding
-        self.edge_encoder = torch.nn.Linear(9, emb_dim)
-
         ### Mapping uniform input features to embedding.
         self.input_layer = input_layer
         if self.input_layer:
@@ -101,29 +92,30 @@ class GCNConv(MessagePassing):
 
         return deg_inv_sqrt[row] * edge_weight * deg_inv_sqrt[col]
 
-    def forward(self, x, edge_index, edge_attr):
-        # add self loops in the edge space
-        edge_index = add_self_loops(edge_index, num_nodes=x.size(0))
-
-        # add features corresponding to self-loop edges.
-        self_loop_attr = torch.zeros(x.size(0), 9)
-        self_loop_attr[:, 7] = 1  # attribute for self-loop edge
-        self_loop_attr = self_loop_attr.to(edge_attr.device).to(edge_attr.dtype)
-        edge_attr = torch.cat((edge_attr, self_loop_attr), dim=0)
-
-        edge_embeddings = self.edge_encoder(edge_attr)
+    def forward(self, x, edge_index, edge_embeddings, norm=None):
+        # edge_index already carries the self-loops (appended once in the collate)
+        # and edge_embeddings the matching shared projection from the GNN
 
         if self.input_layer:
             x = self.input_node_embeddings(x.to(torch.int64).view(-1, ))
 
-        norm = self.norm(edge_index, x.size(0), x.dtype)
+        if norm is None:
+            norm = self.norm(edge_index, x.size(0), x.dtype)
 
         x = self.linear(x)
 
-        return self.propagate(self.aggr, edge_index, x=x, edge_attr=edge_embeddings, norm=norm)
+        # under autocast the linear runs in bf16 while the shared norm stays
+        # fp32; sparse.mm does no type promotion, so align norm with x first
+        norm = norm.to(x.dtype)
 
-    def message(self, x_j, edge_attr, norm):
-        return norm.view(-1, 1) * (x_j + edge_attr)
+        # summing norm * (x_j + e) per destination is a sparse matmul over the
+        # normalized adjacency plus a segment reduction of the edge term; the
+        # spmm path never materializes the edge-sized x_j tensor
+        dst, src = edge_index[1], edge_index[0]
+        adj = torch.sparse_coo_tensor(torch.stack((dst, src)), norm, (x.size(0), x.size(0)))
+        out = torch.sparse.mm(adj, x)
+        out = out + segment_coo(norm.unsqueeze(-1) * edge_embeddings, dst, dim_size=x.size(0), reduce='sum')
+        return out
 
 
 class GATConv(MessagePassing):
@@ -141,9 +133,6 @@ class GATConv(MessagePassing):
 
         self.bias = torch.nn.Parameter(torch.Tensor(emb_dim))
 
-        ### Mapping 0/1 edge features to embedding
-        self.edge_encoder = torch.nn.Linear(9, heads * emb_dim)
-
         ### Mapping uniform input features to embedding.
         self.input_layer = input_layer
         if self.input_layer:
@@ -156,29 +145,23 @@ class GATConv(MessagePassing):
         glorot(self.att)
         zeros(self.bias)
 
-    def forward(self, x, edge_index, edge_attr):
-        # add self loops in the edge space
-        edge_index = add_self_loops(edge_index, num_nodes=x.size(0))
-
-        # add features corresponding to self-loop edges.
-        self_loop_attr = torch.zeros(x.size(0), 9)
-        self_loop_attr[:, 7] = 1  # attribute for self-loop edge
-        self_loop_attr = self_loop_attr.to(edge_attr.device).to(edge_attr.dtype)
-        edge_attr = torch.cat((edge_attr, self_loop_attr), dim=0)
-
-        edge_embeddings = self.edge_encoder(edge_attr)
+    def forward(self, x, edge_index, edge_embeddings):
+        # edge_index already carries the self-loops (appended once in the collate)
+        # and edge_embeddings the matching shared projection from the GNN
 
         if self.input_layer:
             x = self.input_node_embeddings(x.to(torch.int64).view(-1, ))
 
         x = self.weight_linear(x).view(-1, self.heads, self.emb_dim)
-        return self.propagate(self.aggr, edge_index, x=x, edge_attr=edge_embeddings)
+        return self.propagate(edge_index, x=x, edge_attr=edge_embeddings)
 
     def message(self, edge_index, x_i, x_j, edge_attr):
-        edge_attr = edge_attr.view(-1, self.heads, self.emb_dim)
-        x_j += edge_attr
+        x_j = x_j + edge_attr.view(-1, self.heads, self.emb_dim)
 
-        alpha = (torch.cat([x_i, x_j], dim=-1) * self.att).sum(dim=-1)
+        # split the attention vector into its x_i / x_j halves so the
+        # [E, heads, 2*emb_dim] concat is never materialized
+        alpha = (x_i * self.att[..., :self.emb_dim]).sum(dim=-1) \
+                + (x_j * self.att[..., self.emb_dim:]).sum(dim=-1)
 
         alpha = F.leaky_relu(alpha, self.negative_slope)
         alpha = softmax(alpha, edge_index[0])
@@ -191,6 +174,12 @@ class GATConv(MessagePassing):
 
         return aggr_out
 
+    def aggregate(self, inputs, index, ptr=None, dim_size=None):
+        # edges arrive destination-sorted from the collate, so the coalesced
+        # segment reduction applies instead of atomic scatter
+        reduce = 'sum' if self.aggr == 'add' else self.aggr
+        return segment_coo(inputs, index, dim_size=dim_size, reduce=reduce)
+
 
 class GraphSAGEConv(MessagePassing):
     def __init__(self, emb_dim, aggr="mean", input_layer=False):
@@ -199,9 +188,6 @@ class GraphSAGEConv(MessagePassing):
         self.emb_dim = emb_dim
         self.linear = torch.nn.Linear(emb_dim, emb_dim)
 
-        ### Mapping 0/1 edge features to embedding
-        self.edge_encoder = torch.nn.Linear(9, emb_dim)
-
         ### Mapping uniform input features to embedding.
         self.input_layer = input_layer
         if self.input_layer:
@@ -210,24 +196,16 @@ class GraphSAGEConv(MessagePassing):
 
         self.aggr = aggr
 
-    def forward(self, x, edge_index, edge_attr):
-        # add self loops in the edge space
-        edge_index = add_self_loops(edge_index, num_nodes=x.size(0))
-
-        # add features corresponding to self-loop edges.
-        self_loop_attr = torch.zeros(x.size(0), 9)
-        self_loop_attr[:, 7] = 1  # attribute for self-loop edge
-        self_loop_attr = self_loop_attr.to(edge_attr.device).to(edge_attr.dtype)
-        edge_attr = torch.cat((edge_attr, self_loop_attr), dim=0)
-
-        edge_embeddings = self.edge_encoder(edge_attr)
+    def forward(self, x, edge_index, edge_embeddings):
+        # edge_index already carries the self-loops (appended once in the collate)
+        # and edge_embeddings the matching shared projection from the GNN
 
         if self.input_layer:
             x = self.input_node_embeddings(x.to(torch.int64).view(-1, ))
 
         x = self.linear(x)
 
-        return self.propagate(self.aggr, edge_index, x=x, edge_attr=edge_embeddings)
+        return self.propagate(edge_index, x=x, edge_attr=edge_embeddings)
 
     def message(self, x_j, edge_attr):
         return x_j + edge_attr
@@ -235,6 +213,12 @@ class GraphSAGEConv(MessagePassing):
     def update(self, aggr_out):
         return F.normalize(aggr_out, p=2, dim=-1)
 
+    def aggregate(self, inputs, index, ptr=None, dim_size=None):
+        # edges arrive destination-sorted from the collate, so the coalesced
+        # segment reduction applies instead of atomic scatter
+        reduce = 'sum' if self.aggr == 'add' else self.aggr
+        return segment_coo(inputs, index, dim_size=dim_size, reduce=reduce)
+
 
 class GNN(torch.nn.Module):
 
@@ -268,6 +252,10 @@ class GNN(torch.nn.Module):
             elif gnn_type == "graphsage":
                 self.gnns.append(GraphSAGEConv(emb_dim, input_layer=input_layer))
 
+        ### one edge projection shared by all layers; every conv saw the same
+        ### edge_attr, so per-layer encoders only duplicated the matmul
+        self.edge_encoder = torch.nn.Linear(9, 2 * emb_dim if gnn_type == "gat" else emb_dim)
+
         prompt_num = 2
 
         gating = 0.01
@@ -280,13 +268,22 @@ class GNN(torch.nn.Module):
         for i in range(prompt_num):
             self.prompts.append(torch.nn.ModuleList())
 
-            bottleneck_dim = self.compute_bottleneck_dim(layer, num_layer)
+        ### bottleneck dims per layer; computing this inside the prompt loop
+        ### used to pick up the stale `layer` from the conv loop above, giving
+        ### every prompt the last layer's dim
+        self.bottleneck_dims = [self.compute_bottleneck_dim(layer, num_layer) for layer in range(num_layer)]
+
+        ### prompt 1 consumes the conv's aggregated features, whose width
+        ### depends on the conv type: GIN concatenates node and edge halves
+        ### into 2*emb_dim, while the GCN spmm output stays emb_dim wide
+        aggr_dim = 2 * emb_dim if gnn_type == "gin" else emb_dim
 
         for layer in range(num_layer):
+            bottleneck_dim = self.bottleneck_dims[layer]
             for i in range(prompt_num):
                 if bottleneck_dim > 0:
                     self.prompts[i].append(torch.nn.Sequential(
-                        torch.nn.Linear(2 * emb_dim if i > 0 else emb_dim, bottleneck_dim),
+                        torch.nn.Linear(aggr_dim if i > 0 else emb_dim, bottleneck_dim),
                         torch.nn.ReLU(),
                         torch.nn.Linear(bottleneck_dim, emb_dim),
                         torch.nn.BatchNorm1d(emb_dim)
@@ -296,6 +293,10 @@ class GNN(torch.nn.Module):
                 else:
                     self.prompts[i].append(torch.nn.BatchNorm1d(emb_dim))
 
+        # per-layer activation, so the forward loop carries no layer-dependent branch
+        # (the last layer has no relu); keeps the traced graph branch-free for torch.compile
+        self._layer_acts = [F.relu] * (num_layer - 1) + [torch.nn.Identity()]
+
 
     def compute_bottleneck_dim(self, layer, total_layers):
         """
@@ -306,31 +307,53 @@ class GNN(torch.nn.Module):
         return int(self.min_bottleneck_dim + (self.max_bottleneck_dim - self.min_bottleneck_dim) * (
                     layer / (total_layers - 1)))
 
-    def forward(self, x, edge_index, edge_attr, prompt):
-        h_list = [x]
-        for layer in range(self.num_layer):
-            h = h_list[layer]
+    def forward(self, x, edge_index, edge_attr, prompt, perm=None):
+        prompts0, prompts1 = self.prompts
+        # slice the gating parameter once instead of indexing [p][layer] per layer
+        g0, g1 = self.gating[0], self.gating[1]
 
-            h, x_embeded, x_aggr = self.gnns[layer](h, edge_index, edge_attr, prompt)
+        # project the edge features once for all layers; self-loops share the
+        # constant embedding edge_encoder(one_hot(7)), so the zeros(N, 9) attr
+        # rows are never built
+        edge_embeddings = self.edge_encoder(edge_attr)
+        self_loop_emb = self.edge_encoder.bias + self.edge_encoder.weight[:, 7]
+        num_nodes = edge_index.size(1) - edge_attr.size(0)
+        edge_embeddings = torch.cat((edge_embeddings, self_loop_emb.expand(num_nodes, -1)), dim=0)
+        if perm is not None:
+            edge_embeddings = edge_embeddings[perm]
+
+        # the GCN normalization depends only on topology, so compute it once
+        # per batch and share it across all layers
+        gcn_norm = None
+        if isinstance(self.gnns[0], GCNConv):
+            dtype = x.dtype if torch.is_floating_point(x) else torch.get_default_dtype()
+            gcn_norm = self.gnns[0].norm(edge_index, x.size(0), dtype)
+
+        h = x
+        # running sum for JK="sum" instead of holding every layer's hidden
+        # state and cat/summing a [num_layer, N, emb_dim] stack at the end
+        h_sum = None
+        for layer in range(self.num_layer):
+            if gcn_norm is not None:
+                h = self.gnns[layer](h, edge_index, edge_embeddings, norm=gcn_norm)
+                x_embeded, x_aggr = h, h
+            else:
+                h, x_embeded, x_aggr = self.gnns[layer](h, edge_index, edge_embeddings, prompt)
 
-            delta = self.prompts[0][layer](x_embeded)
-            h = h + delta * self.gating[0][layer]
-            delta = self.prompts[1][layer](x_aggr)
-            h = h + delta * self.gating[1][layer]
+            delta0 = prompts0[layer](x_embeded)
+            delta1 = prompts1[layer](x_aggr)
+            # gated residual as two fused multiply-adds instead of four pointwise kernels
+            h = torch.addcmul(torch.addcmul(h, delta0, g0[layer]), delta1, g1[layer])
 
-            if layer < self.num_layer - 1:
-                h = F.relu(h)
+            h = self._layer_acts[layer](h)
             h = F.dropout(h, self.drop_ratio, training=self.training)
 
-            h_list.append(h)
-
-        if self.JK == "last":
-            node_representation = h_list[-1]
-        elif self.JK == "sum":
-            h_list = [h.unsqueeze_(0) for h in h_list]
-            node_representation = torch.sum(torch.cat(h_list[1:], dim=0), dim=0)[0]
+            if self.JK == "sum":
+                if h_sum is None:
+                    h_sum = torch.zeros_like(h)
+                h_sum.add_(h)
 
-        return node_representation
+        return h_sum if self.JK == "sum" else h
 
 
 
@@ -363,20 +386,34 @@ class AdapterGPFE_graphpred(torch.nn.Module):
         else:
             raise ValueError("Invalid graph pooling type.")
 
-        self.graph_pred_linear = torch.nn.Linear(self.emb_dim, self.num_tasks)
+        ### one head per representation (pooled graph / center node); summing the
+        ### two projections equals projecting the concat, without the [B, 2*D] cat
+        self.graph_pred_linear = torch.nn.ModuleList([torch.nn.Linear(self.emb_dim, self.num_tasks),
+                                                      torch.nn.Linear(self.emb_dim, self.num_tasks)])
     def from_pretrained(self, model_file):
-        self.gnn.load_state_dict(torch.load(model_file, map_location=lambda storage, loc: storage), strict=False)
+        state_dict = torch.load(model_file, map_location=lambda storage, loc: storage)
+        ### pretrained checkpoints carry one edge_encoder per conv; seed the
+        ### shared encoder from the first layer's copy
+        if 'gnns.0.edge_encoder.weight' in state_dict and 'edge_encoder.weight' not in state_dict:
+            state_dict['edge_encoder.weight'] = state_dict['gnns.0.edge_encoder.weight']
+            state_dict['edge_encoder.bias'] = state_dict['gnns.0.edge_encoder.bias']
+        self.gnn.load_state_dict(state_dict, strict=False)
 
     def forward(self, data, prompt):
-        x, edge_index, edge_attr, batch, prompt = data.x, data.edge_index, data.edge_attr, data.batch, prompt
-        node_representation = self.gnn(x, edge_index, edge_attr, prompt)
+        x, edge_attr, batch = data.x, data.edge_attr, data.batch
+        if 'edge_index_with_self_loops' in data:
+            edge_index = data.edge_index_with_self_loops
+            perm = data.edge_sl_perm
+        else:
+            edge_index = add_self_loops(data.edge_index, num_nodes=x.size(0))[0]
+            perm = torch.argsort(edge_index[1])
+            edge_index = edge_index[:, perm]
+        node_representation = self.gnn(x, edge_index, edge_attr, prompt, perm)
 
         pooled = self.pool(node_representation, batch)
         center_node_rep = node_representation[data.center_node_idx]
 
-        graph_rep = torch.cat([pooled, dim=1)
-
-        return self.graph_pred_linear(graph_rep)
+        return self.graph_pred_linear[0](pooled) + self.graph_pred_linear[1](center_node_rep)
 
 
 if __name__ == "__main__":
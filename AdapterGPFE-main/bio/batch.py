@@ -47,6 +47,24 @@ class BatchFinetune(Data):
             batch[key] = torch.cat(
                 batch[key], dim=data_list[0].__cat_dim__(key, batch[key][0]))
         batch.batch = torch.cat(batch.batch, dim=-1)
+
+        ### reshape/cast the downstream targets here, in the loader workers,
+        ### so train/eval do not re-run view + to(float) on every step
+        if 'go_target_downstream' in keys:
+            batch.go_target_downstream = batch.go_target_downstream.view(len(data_list), -1).to(torch.float32)
+
+        ### self-loop augmented topology, built once per batch on the loader side
+        ### so the convs do not re-run add_self_loops on every layer
+        self_loop_index = torch.arange(cumsum_node, dtype=torch.long).unsqueeze(0).repeat(2, 1)
+        edge_index_with_self_loops = torch.cat([batch.edge_index, self_loop_index], dim=1)
+
+        ### sort by destination so aggregation can use a coalesced segment
+        ### reduction (segment_coo) instead of atomic scatter; the permutation
+        ### maps the [real edges | self loops] embedding order to sorted order
+        perm = torch.argsort(edge_index_with_self_loops[1])
+        batch.edge_index_with_self_loops = edge_index_with_self_loops[:, perm]
+        batch.edge_sl_perm = perm
+
         return batch.contiguous()
 
     @property
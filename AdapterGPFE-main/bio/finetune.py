@@ -8,7 +8,6 @@ import torch.optim as optim
 import numpy as np
 from model import GNN_graphpred
 from adapterGPFE import AdapterGPFE_graphpred
-from sklearn.metrics import roc_auc_score
 import os
 import logging
 import statistics
@@ -17,20 +16,57 @@ import gpfe as Prompt
 criterion = nn.BCEWithLogitsLoss()
 
 
+def multitask_auc(y_true, y_scores):
+    """Rank-based ROC-AUC over all task columns at once.
+
+    Matches per-column sklearn roc_auc_score, including tied scores, via
+    midranks; columns that miss one of the two classes contribute nan, as
+    before.
+    """
+    n = y_true.size(0)
+    order = y_scores.argsort(dim=0)
+    sorted_scores = y_scores.gather(0, order)
+
+    # midranks: every member of an equal-score run gets the run's average
+    # rank, which keeps the statistic exact when scores are quantized
+    # (e.g. bf16 eval under --bf16)
+    base_ranks = torch.arange(1, n + 1, dtype=y_scores.dtype).unsqueeze(1).expand_as(order).contiguous()
+    group = torch.ones_like(order)
+    group[1:] = (sorted_scores[1:] != sorted_scores[:-1]).long()
+    group = group.cumsum(dim=0) - 1
+    counts = torch.zeros_like(y_scores).scatter_add_(0, group, torch.ones_like(y_scores))
+    rank_sums = torch.zeros_like(y_scores).scatter_add_(0, group, base_ranks)
+    midranks = (rank_sums / counts).gather(0, group)
+    ranks = torch.empty_like(y_scores).scatter_(0, order, midranks)
+
+    pos = y_true == 1
+    n_pos = pos.sum(dim=0, dtype=y_scores.dtype)
+    n_neg = (y_true == 0).sum(dim=0, dtype=y_scores.dtype)
+
+    auc = ((ranks * pos).sum(dim=0) - n_pos * (n_pos + 1) / 2) / (n_pos * n_neg)
+    auc[(n_pos == 0) | (n_neg == 0)] = float('nan')
+
+    return auc.mean().item()
+
+
 def train(args, model, device, loader, optimizer,prompt):
     model.train()
 
     for step, batch in enumerate(loader):
-        batch = batch.to(device)
-        pred = model(batch,prompt)
+        batch = batch.to(device, non_blocking=True)
+        # the pretrained backbone weights are frozen during finetuning, so the
+        # forward can run in bf16; the BCE loss below stays in full precision
+        with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=bool(args.bf16)):
+            pred = model(batch,prompt)
 
         # pred = model(batch.x, batch.edge_index, batch.edge_attr, batch.batch, prompt)
 
 
-        y = batch.go_target_downstream.view(pred.shape).to(torch.float64)
+        # targets already arrive as float32 [B, num_tasks] from the collate
+        y = batch.go_target_downstream
 
-        optimizer.zero_grad()
-        loss = criterion(pred.double(), y)
+        optimizer.zero_grad(set_to_none=True)
+        loss = criterion(pred.float(), y)
         loss.backward()
 
         optimizer.step()
@@ -38,32 +74,36 @@ def train(args, model, device, loader, optimizer,prompt):
 
 def eval(args, model, device, loader,prompt):
     model.eval()
-    y_true = []
-    y_scores = []
+    y_true = None
+    y_scores = None
+    offset = 0
 
     for step, batch in enumerate(loader):
-        batch = batch.to(device)
+        batch = batch.to(device, non_blocking=True)
 
-        with torch.no_grad():
+        with torch.no_grad(), torch.autocast(device_type=device.type, dtype=torch.bfloat16,
+                                             enabled=bool(args.bf16)):
             pred = model(batch,prompt)
             # pred = model(batch.x, batch.edge_index, batch.edge_attr, batch.batch, prompt)
 
+        if y_true is None:
+            # preallocate pinned host buffers once, so each batch becomes an
+            # async D2H copy instead of a list append plus a final torch.cat
+            pin = device.type == 'cuda'
+            y_true = torch.empty(len(loader.dataset), pred.size(1), dtype=torch.float32, pin_memory=pin)
+            y_scores = torch.empty(len(loader.dataset), pred.size(1), dtype=torch.float32, pin_memory=pin)
 
-        y_true.append(batch.go_target_downstream.view(pred.shape).detach().cpu())
-        y_scores.append(pred.detach().cpu())
-
-    y_true = torch.cat(y_true, dim=0).numpy()
-    y_scores = torch.cat(y_scores, dim=0).numpy()
+        n = pred.size(0)
+        y_true[offset:offset + n].copy_(batch.go_target_downstream, non_blocking=True)
+        y_scores[offset:offset + n].copy_(pred, non_blocking=True)
+        offset += n
 
-    roc_list = []
-    for i in range(y_true.shape[1]):
-        # AUC is only defined when there is at least one positive data.
-        if np.sum(y_true[:, i] == 1) > 0 and np.sum(y_true[:, i] == 0) > 0:
-            roc_list.append(roc_auc_score(y_true[:, i], y_scores[:, i]))
-        else:
-            roc_list.append(np.nan)
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
 
-    return sum(roc_list) / len(roc_list)
+    # one vectorized sort over [N, num_tasks] instead of num_tasks serial
+    # sklearn calls on numpy slices
+    return multitask_auc(y_true[:offset], y_scores[:offset])
 
 
 def main(runseed):
@@ -94,10 +134,12 @@ def main(runseed):
     parser.add_argument('--gnn_type', type=str, default="gin")
     parser.add_argument('--seed', type=int, default=42, help="Seed for splitting dataset.")
     parser.add_argument('--runseed', type=int, default=runseed, help="Seed for running experiments.")
-    parser.add_argument('--num_workers', type=int, default=0, help='number of workers for dataset loading')
+    parser.add_argument('--num_workers', type=int, default=4, help='number of workers for dataset loading')
     parser.add_argument('--eval_train', type=int, default=0, help='evaluating training or not')
     parser.add_argument('--split', type=str, default="species", help='Random or species split')
     parser.add_argument('--log', type=str, default='AdapterGPFE_masking')
+    parser.add_argument('--bf16', type=int, default=0,
+                        help='run the frozen backbone forward under bfloat16 autocast')
 
 
 
@@ -127,6 +169,9 @@ def main(runseed):
     if torch.cuda.is_available():
         torch.cuda.manual_seed_all(args.runseed)
 
+    # allow TF32 on the fp32 matmuls (tensor cores on Ampere+)
+    torch.set_float32_matmul_precision('high')
+
     root_supervised = 'dataset/supervised'
 
     dataset = BioDataset(root_supervised, data_type='supervised')
@@ -146,18 +191,22 @@ def main(runseed):
     else:
         raise ValueError("Unknown split name.")
 
-    train_loader = DataLoaderFinetune(train_dataset, batch_size=args.batch_size, shuffle=True,
-                                      num_workers=args.num_workers)
-    val_loader = DataLoaderFinetune(valid_dataset, batch_size=10 * args.batch_size, shuffle=False,
-                                    num_workers=args.num_workers)
+    # collate in worker processes and hand over pinned batches so H2D copies
+    # can overlap with compute
+    loader_kwargs = dict(num_workers=args.num_workers, pin_memory=True)
+    if args.num_workers > 0:
+        loader_kwargs.update(persistent_workers=True, prefetch_factor=4)
+
+    train_loader = DataLoaderFinetune(train_dataset, batch_size=args.batch_size, shuffle=True, **loader_kwargs)
+    val_loader = DataLoaderFinetune(valid_dataset, batch_size=10 * args.batch_size, shuffle=False, **loader_kwargs)
 
     if args.split == "random":
         test_loader =  DataLoaderFinetune(test_dataset, batch_size=10 * args.batch_size, shuffle=False,
-                                         num_workers=args.num_workers)
+                                         **loader_kwargs)
     else:
         ### for species splitting
         test_easy_loader = DataLoaderFinetune(test_dataset_broad, batch_size=10 * args.batch_size, shuffle=False,
-                                              num_workers=args.num_workers)
+                                              **loader_kwargs)
         # test_hard_loader = DataLoaderFinetune(test_dataset_none, batch_size=10*args.batch_size, shuffle=False, num_workers = args.num_workers)
 
     num_tasks = len(dataset[0].go_target_downstream)
@@ -219,6 +268,10 @@ def main(runseed):
     # set up optimizer
     optimizer = optim.Adam(model_param_group, lr=args.lr, weight_decay=args.decay)
 
+    # fuse the per-layer conv + prompt MLP chain when torch.compile is available (torch >= 2.0)
+    if hasattr(torch, "compile"):
+        model.gnn = torch.compile(model.gnn, mode="reduce-overhead", fullgraph=False, dynamic=True)
+
 
 
     best_val = 0
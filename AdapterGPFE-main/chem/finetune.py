@@ -36,7 +36,10 @@ def train(args, model, device, loader, optimizer, prompt):
 
     for step, batch in enumerate(loader):
         batch = batch.to(device)
-        __, pred = model(batch.x, batch.edge_index, batch.edge_attr, batch.batch, prompt)
+        # the frozen backbone forward can run in bf16; the masked BCE below
+        # stays in full precision
+        with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=bool(args.bf16)):
+            __, pred = model(batch.x, batch.edge_index, batch.edge_attr, batch.batch, prompt)
         y = batch.y.view(pred.shape).to(torch.float64)
 
         # Whether y is non-null or not.
@@ -61,11 +64,13 @@ def eval(args, model, device, loader, prompt):
     for step, batch in enumerate(loader):
         batch = batch.to(device)
 
-        with torch.no_grad():
+        with torch.no_grad(), torch.autocast(device_type=device.type, dtype=torch.bfloat16,
+                                             enabled=bool(args.bf16)):
             __, pred = model(batch.x, batch.edge_index, batch.edge_attr, batch.batch, prompt)
 
         y_true.append(batch.y.view(pred.shape))
-        y_scores.append(pred)
+        # under --bf16 pred is bfloat16, which numpy cannot represent
+        y_scores.append(pred.float())
 
     y_true = torch.cat(y_true, dim=0).cpu().numpy()
     y_scores = torch.cat(y_scores, dim=0).cpu().numpy()
@@ -120,6 +125,8 @@ def main(runseed, dataset):
     parser.add_argument('--eval_train', type=int, default=0, help='evaluating training or not')
     parser.add_argument('--num_workers', type=int, default=4, help='number of workers for dataset loading')
     parser.add_argument('--log', type=str, default='AdapterGPFE_masking')
+    parser.add_argument('--bf16', type=int, default=0,
+                        help='run the model forward under bfloat16 autocast')
 
 
 
@@ -147,6 +154,9 @@ def main(runseed, dataset):
     if torch.cuda.is_available():
         torch.cuda.manual_seed_all(args.runseed)
 
+    # allow TF32 on the fp32 matmuls (tensor cores on Ampere+)
+    torch.set_float32_matmul_precision('high')
+
     # Bunch of classification tasks
     if args.dataset == "tox21":
         num_tasks = 12
@@ -246,6 +256,11 @@ def main(runseed, dataset):
 
     optimizer = optim.Adam(model_param_group, lr=args.lr, weight_decay=args.decay)
 
+    # fuse the per-layer conv + prompt MLP chain when torch.compile is available (torch >= 2.0);
+    # compiled after the optimizer groups so the parameter names above still resolve
+    if hasattr(torch, "compile"):
+        model.gnn = torch.compile(model.gnn, mode="reduce-overhead", fullgraph=False, dynamic=True)
+
 
 
 
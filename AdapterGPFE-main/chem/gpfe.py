@@ -19,8 +19,6 @@ class SimplePromptAtt(nn.Module):
 
     def add(self, x: torch.Tensor):
         # 计算注意力权重
-        attention_scores = F.softmax(self.attention(x), dim=1)  # [N, p_num]
-        # 使用注意力权重对 p_list 进行加权求和，生成每个节点的提示向量 p_i
-        p = torch.matmul(attention_scores, self.p_list)  # [N, in_channels]
-        # 返回输入特征加上生成的提示向量
-        return x + p
\ No newline at end of file
+        attention_scores = F.softmax(self.attention(x), dim=-1)  # [N, p_num]
+        # addmm 将加权求和与残差相加合成一次调用，p 向量不再单独物化
+        return torch.addmm(x, attention_scores, self.p_list)  # [N, in_channels]
\ No newline at end of file
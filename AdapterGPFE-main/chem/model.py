@@ -3,7 +3,6 @@ from torch_geometric.nn import MessagePassing
 from torch_geometric.utils import add_self_loops, degree, softmax
 from torch_geometric.nn import global_add_pool, global_mean_pool, global_max_pool, GlobalAttention, Set2Set
 import torch.nn.functional as F
-from torch_scatter import scatter_add
 from torch_geometric.nn.inits import glorot, zeros
 
 num_atom_type = 120  # including the extra mask tokens
@@ -75,14 +74,13 @@ class GCNConv(MessagePassing):
 
     def norm(self, edge_index, num_nodes, dtype):
         ### assuming that self-loops have been already added in edge_index
-        edge_weight = torch.ones((edge_index.size(1),), dtype=dtype,
-                                 device=edge_index.device)
+        ### unit edge weights: the degree is a plain bincount, and the
+        ### self-loops guarantee degree >= 1, so clamp replaces the inf mask
         row, col = edge_index
-        deg = scatter_add(edge_weight, row, dim=0, dim_size=num_nodes)
-        deg_inv_sqrt = deg.pow(-0.5)
-        deg_inv_sqrt[deg_inv_sqrt == float('inf')] = 0
+        deg = torch.bincount(row, minlength=num_nodes).to(dtype)
+        deg_inv_sqrt = deg.clamp_(min=1).pow_(-0.5)
 
-        return deg_inv_sqrt[row] * edge_weight * deg_inv_sqrt[col]
+        return deg_inv_sqrt[row] * deg_inv_sqrt[col]
 
     def forward(self, x, edge_index, edge_attr):
         # add self loops in the edge space
@@ -282,11 +280,11 @@ class GNN(torch.nn.Module):
         elif self.JK == "last":
             node_representation = h_list[-1]
         elif self.JK == "max":
-            h_list = [h.unsqueeze_(0) for h in h_list]
-            node_representation = torch.max(torch.cat(h_list, dim=0), dim=0)[0]
+            ### out-of-place stack: unsqueeze_ mutated the cached activations,
+            ### which breaks CUDA graph capture under torch.compile
+            node_representation = torch.max(torch.stack(h_list, dim=0), dim=0)[0]
         elif self.JK == "sum":
-            h_list = [h.unsqueeze_(0) for h in h_list]
-            node_representation = torch.sum(torch.cat(h_list, dim=0), dim=0)[0]
+            node_representation = torch.sum(torch.stack(h_list, dim=0), dim=0)
 
         return node_representation
 